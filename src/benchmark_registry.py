@@ -0,0 +1,172 @@
+import argparse
+import gc
+import random
+import resource
+import subprocess
+import sys
+import tracemalloc
+
+from cycles import generate_cycles
+from log import log
+from registry import ThingRegistry
+
+def make_synthetic_thing(i, n_vertices):
+    """
+    Make a synthetic thing shaped like the ones returned by the FROST server for the synced traffic lights.
+    """
+    random.seed(i)
+    x, y = 13.7 + random.random() * 0.1, 51.0 + random.random() * 0.1
+    geometry = [[x + j * 1e-5, y + j * 1e-5] for j in range(n_vertices)]
+    def datastream(ds_id, layer_name):
+        return {
+            "@iot.id": ds_id,
+            "name": f"{layer_name} at SG{i+1}",
+            "description": "Synthetic datastream",
+            "observationType": "http://www.opengis.net/def/property/OGC/0/SensorStatus",
+            "properties": {
+                "layerName": layer_name,
+                "namespace": "Not yet available",
+                "ownerData": "Free and Hanseatic City of Hamburg",
+                "serviceName": "HH_STA_traffic_lights",
+                "resultsNature": "Primary",
+                "signalGroupID": "K2",
+                "mediaMonitored": "Transport",
+            },
+            "unitOfMeasurement": {"name": "Status", "symbol": "-", "definition": "Not available"},
+        }
+    return {
+        "@iot.id": i,
+        "name": f"SG{i+1}",
+        "description": "Connection of lanes subject to a specific signal head",
+        "properties": {
+            "topic": "Transportation and traffic",
+            "keywords": ["TLF", "LSA", "Dresden"],
+            "laneType": "Radfahrer",
+            "connectionID": f"{i}",
+        },
+        "Locations": [{
+            "@iot.id": i,
+            "encodingType": "application/vnd.geo+json",
+            "location": {
+                "type": "Feature",
+                "geometry": {
+                    "type": "MultiLineString",
+                    # Three separate copies, as they are after JSON decoding.
+                    "coordinates": [[list(c) for c in geometry] for _ in range(3)],
+                },
+            },
+        }],
+        "Datastreams": [
+            datastream(3 * i + 1, 'signal_program'),
+            datastream(3 * i + 2, 'cycle_second'),
+            datastream(3 * i + 3, 'primary_signal'),
+        ],
+    }
+
+def measure(build):
+    """
+    Return the (retained, peak) traced heap bytes allocated by `build()` while its result is still alive.
+
+    Only Python allocations traced by `tracemalloc` are counted.
+    """
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return retained, peak
+
+def generate_list_cycles(thing_name):
+    """
+    The previous representation of `generate_cycles()`: lists of ints, with repeated hours shared.
+    """
+    cycles, program_ids = generate_cycles(thing_name)
+    lists_by_cycle = {}
+    return [lists_by_cycle.setdefault(id(cycle), list(cycle)) for cycle in cycles], list(program_ids)
+
+def build_dicts(n_things, n_vertices):
+    """
+    The previous approach: the full things list plus parallel dicts keyed by name.
+    """
+    things = [make_synthetic_thing(i, n_vertices) for i in range(n_things)]
+    cycles_by_thing_and_hour = {
+        thing['name']: generate_list_cycles(thing['name'])
+        for thing in things
+    }
+    primary_signal_ids_by_thing = {}
+    cycle_second_ids_by_thing = {}
+    signal_program_ids_by_thing = {}
+    for thing in things:
+        for datastream in thing['Datastreams']:
+            if datastream['properties']['layerName'] == 'primary_signal':
+                primary_signal_ids_by_thing[thing['name']] = datastream['@iot.id']
+            elif datastream['properties']['layerName'] == 'cycle_second':
+                cycle_second_ids_by_thing[thing['name']] = datastream['@iot.id']
+            elif datastream['properties']['layerName'] == 'signal_program':
+                signal_program_ids_by_thing[thing['name']] = datastream['@iot.id']
+    last_primary_signal = { t['name']: 1 for t in things }
+    last_program = { t['name']: 0 for t in things }
+    return things, cycles_by_thing_and_hour, primary_signal_ids_by_thing, cycle_second_ids_by_thing, signal_program_ids_by_thing, last_primary_signal, last_program
+
+def build_registry(n_things, n_vertices):
+    """
+    The registry, fed by a generator like `syncer.iter_things()`, plus the compact cycles of the generator.
+    """
+    registry = ThingRegistry.from_things(make_synthetic_thing(i, n_vertices) for i in range(n_things))
+    cycles_by_thing_and_hour = [
+        generate_cycles(thing_name)
+        for thing_name in registry.names
+    ]
+    return registry, cycles_by_thing_and_hour
+
+BUILDS = {
+    'none': lambda n_things, n_vertices: None,
+    'dicts': build_dicts,
+    'registry': build_registry,
+}
+
+def measure_rss(build_name, n_things, n_vertices):
+    """
+    Return the maximum resident set size in bytes of a fresh process that runs the given build.
+    """
+    output = subprocess.run(
+        [sys.executable, __file__, '--rss', build_name, '--things', str(n_things), '--vertices', str(n_vertices)],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return int(output)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the memory used by the ThingRegistry and compact cycles with the full things list.')
+    parser.add_argument('--things', type=int, nargs='+', default=[500, 2_000])
+    parser.add_argument('--vertices', type=int, default=20, help='Vertices per connection geometry.')
+    parser.add_argument('--rss', choices=BUILDS.keys(), help=argparse.SUPPRESS) # Used by measure_rss()
+    args = parser.parse_args()
+
+    if args.rss is not None:
+        result = BUILDS[args.rss](args.things[0], args.vertices)
+        # ru_maxrss is in kilobytes on Linux (but in bytes on macOS).
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        print(max_rss if sys.platform == 'darwin' else max_rss * 1024)
+        exit(0)
+
+    # Resident set size of the interpreter with the imports, but without any things.
+    rss_base = measure_rss('none', 0, args.vertices)
+    log(f'Baseline RSS of the interpreter: {rss_base / 1e6:.1f} MB')
+    for n_things in args.things:
+        dicts_rss = measure_rss('dicts', n_things, args.vertices) - rss_base
+        registry_rss = measure_rss('registry', n_things, args.vertices) - rss_base
+        log(
+            f'{n_things} things, max RSS above baseline: '
+            f'dicts {dicts_rss / 1e6:.1f} MB, registry {registry_rss / 1e6:.1f} MB, '
+            f'{dicts_rss / max(registry_rss, 1):.0f}x less'
+        )
+        dicts_retained, dicts_peak = measure(lambda: build_dicts(n_things, args.vertices))
+        registry_retained, registry_peak = measure(lambda: build_registry(n_things, args.vertices))
+        log(
+            f'{n_things} things, traced Python heap (tracemalloc): '
+            f'dicts retain {dicts_retained / 1e6:.1f} MB (peak {dicts_peak / 1e6:.1f} MB), '
+            f'registry retains {registry_retained / 1e6:.1f} MB (peak {registry_peak / 1e6:.1f} MB), '
+            f'{dicts_retained / max(registry_retained, 1):.0f}x less'
+        )
@@ -5,6 +5,7 @@ import time
 import paho.mqtt.client as mqtt
 
 from log import log
+from registry import REGISTRY_QUERY, ThingRegistry
 
 CTRLMESSAGES_MQTT_HOST = os.getenv('CTRLMESSAGES_MQTT_HOST')
 CTRLMESSAGES_MQTT_PORT = int(os.getenv('CTRLMESSAGES_MQTT_PORT'))
@@ -22,7 +23,7 @@ if any(v is None for v in [FROST_MQTT_HOST, FROST_MQTT_PORT, FROST_MQTT_USER, FR
     log('Missing environment variables')
     exit(1)
 
-def run_tls_message_converter(things):
+def run_tls_message_converter(registry):
     """
     Run the TLS Message Converter - Bridge from the TLS controller service to the FROST-Server.
 
@@ -30,19 +31,9 @@ def run_tls_message_converter(things):
 
     The TLS controller sends MQTT messages that are interpreted by the physical test traffic lights for Dresden.
     This script converts these messages into FROST Observations to make them available to our prediction service.
+    The datastream IDs needed to publish the Observations are looked up in the given `ThingRegistry`.
     """
 
-    # Unwrap all the datastream IDs from the things for faster access.
-    # We will need these IDs later to publish the Observations.
-    primary_signal_ids_by_thing = {}
-    cycle_second_ids_by_thing = {}
-    for thing in things:
-        for datastream in thing['Datastreams']:
-            if datastream['properties']['layerName'] == 'primary_signal':
-                primary_signal_ids_by_thing[thing['name']] = datastream['@iot.id']
-            elif datastream['properties']['layerName'] == 'cycle_second':
-                cycle_second_ids_by_thing[thing['name']] = datastream['@iot.id']
-
     # Initiate the MQTT clients: one for inbound messages and one for outbound messages.
     client_inbound = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
     if CTRLMESSAGES_MQTT_USER and CTRLMESSAGES_MQTT_PASS:
@@ -77,6 +68,7 @@ def run_tls_message_converter(things):
         if not topic.startswith('simulation/sg/'):
             return
         thing_name = topic.split('/')[-1] # e.g. SG1 or SG2
+        idx = registry.index_by_name.get(thing_name)
 
         # Prepare the Observation payload.
         current_time = time.time()
@@ -87,7 +79,7 @@ def run_tls_message_converter(things):
         
         # Traffic light starts a new program cycle: Make a Program Observation.
         if content == 'startNewCycle':
-            ds_cycle_second = cycle_second_ids_by_thing.get(thing_name)
+            ds_cycle_second = registry.cycle_second_ids[idx] if idx is not None else None
             if ds_cycle_second is None:
                 raise ValueError(f'No cycle for thing {thing_name}')
             payload = payload = {
@@ -107,7 +99,7 @@ def run_tls_message_converter(things):
             'GREEN': 3,
             'AMBER': 2,
         }.get(content) # Convert the TLS controller format to the FROST format.
-        ds_primary_signal = primary_signal_ids_by_thing.get(thing_name)
+        ds_primary_signal = registry.primary_signal_ids[idx] if idx is not None else None
         if ds_primary_signal is None:
             raise ValueError(f'No primary signal for thing {thing_name}')
         payload = {
@@ -159,19 +151,18 @@ def run_tls_message_converter(things):
 
 # Run the TLS Message Converter if this script is called directly.
 if __name__ == '__main__':
-    from syncer import get_all_things
+    from syncer import iter_things
 
     log('Fetching things to process...')
-    things = get_all_things()
     # Throw away any things that are not the TLS traffic lights.
-    things_for_tls_message_converter = [
-        t for t in things 
-        if t['name'] == 'SG1' or t['name'] == 'SG2'
-    ]
+    registry = ThingRegistry.from_things(
+        iter_things(REGISTRY_QUERY),
+        include=lambda name: name == 'SG1' or name == 'SG2',
+    )
 
-    if len(things_for_tls_message_converter) == 0:
+    if len(registry) == 0:
         log('No things found')
         exit(1)
 
-    log(f'Found {len(things_for_tls_message_converter)} things')
-    run_tls_message_converter(things_for_tls_message_converter)
\ No newline at end of file
+    log(f'Found {len(registry)} things')
+    run_tls_message_converter(registry)
\ No newline at end of file
@@ -1,13 +1,13 @@
 import json
-import math
 import os
-import random
 import time
 from datetime import datetime
 
 import paho.mqtt.client as mqtt
 
+from cycles import generate_cycles
 from log import log
+from registry import REGISTRY_QUERY, ThingRegistry
 
 FROST_MQTT_HOST = os.getenv('FROST_MQTT_HOST')
 FROST_MQTT_PORT = int(os.getenv('FROST_MQTT_PORT'))
@@ -17,86 +17,11 @@ if any(v is None for v in [FROST_MQTT_HOST, FROST_MQTT_PORT, FROST_MQTT_USER, FR
     log('Missing environment variables')
     exit(1)
 
-# Define the possible states of a traffic light.
-dark = 0
-red = 1
-amber = 2
-green = 3
-redamber = 4
-
-def generate_cycles(thing_name):
-    """
-    Generate a random program (cycles per hour) for a thing.
-
-    For the same thing, this function will always return the same cycle.
-    """
-    cycles = []
-    for hour_of_day in range(24):
-        random.seed(hash(thing_name) + hour_of_day)
-
-        # Simulate that traffic lights turn off at night.
-        probability_of_dark = [
-            1 - min(
-                1.0, 
-                0.7
-                + ((math.sin((math.pi / 4) * (h - 4)) + 1) / 2) * 0.1
-                + ((math.sin((math.pi / 12) * (h - 6)) + 1) / 2) * 0.3
-            )
-            for h in range(24)
-        ]
-        if random.random() < probability_of_dark[hour_of_day]:
-            cycles.append([dark] * 60)
-            continue
-
-        states = random.choices([
-            [red, green, red],
-            [red, redamber, green, amber, red],
-            [red, red],
-            [green, green],
-        ], k=1, weights=[ 
-            # Based on analyses of real traffic light programs in Hamburg.
-            2930, 
-            2405,
-            1753,
-            622,
-        ])[0]
-
-        states_lengths = []
-        for state in states:
-            if state == red:
-                states_lengths.append(random.randint(5, 30))
-            elif state == amber:
-                states_lengths.append(random.randint(3, 5)) # Constrained by German traffic light law
-            elif state == green:
-                states_lengths.append(random.randint(10, 30))
-            elif state == redamber:
-                states_lengths.append(1) # Constrained by German traffic light law
-            elif state == dark:
-                states_lengths.append(random.randint(5, 10))
-            else:
-                raise ValueError('Unknown state')
-
-        cycle = []
-        for state, state_length in zip(states, states_lengths):
-            cycle.extend([state] * state_length)
-        cycles.append(cycle)
-
-    # Don't change the program every hour.
-    random.seed(hash(thing_name))
-    probability_of_program_change = random.random()
-    program_ids = list(range(24))
-    for i in range(24):
-        if random.random() < probability_of_program_change:
-            cycles[i] = cycles[i - 1]
-            program_ids[i] = program_ids[i - 1]
-
-    return cycles, program_ids
-
-def run_message_generator(things):
+def run_message_generator(registry):
     """
     Run the Observation message generator.
 
-    This function will generate and publish Observations for the given things.
+    This function will generate and publish Observations for the things in the given `ThingRegistry`.
     """
     # Define a healthcheck var to monitor the connection to the MQTT broker.
     message_published = None # Will be set to a timestamp when a message is received.
@@ -125,42 +50,33 @@ def run_message_generator(things):
         client.username_pw_set(FROST_MQTT_USER, FROST_MQTT_PASS)
     client.connect(FROST_MQTT_HOST, FROST_MQTT_PORT, 60)
 
-    # Generate cycles for all things.
-    cycles_by_thing_and_hour = { 
-        thing['name']: generate_cycles(thing['name'])
-        for thing in things 
-    }
-
-    # Unwrap all the datastream IDs from the things for faster access.
-    # We will need these IDs later to publish the Observations.
-    primary_signal_ids_by_thing = {}
-    cycle_second_ids_by_thing = {}
-    signal_program_ids_by_thing = {}
-    for thing in things:
-        for datastream in thing['Datastreams']:
-            # properties -> layerName
-            if datastream['properties']['layerName'] == 'primary_signal':
-                primary_signal_ids_by_thing[thing['name']] = datastream['@iot.id']
-            elif datastream['properties']['layerName'] == 'cycle_second':
-                cycle_second_ids_by_thing[thing['name']] = datastream['@iot.id']
-            elif datastream['properties']['layerName'] == 'signal_program':
-                signal_program_ids_by_thing[thing['name']] = datastream['@iot.id']
+    # Generate cycles for all things, indexed like the registry.
+    cycles_by_thing_and_hour = [
+        generate_cycles(thing_name)
+        for thing_name in registry.names
+    ]
+
+    # The datastream IDs and the last states are kept in the registry's parallel arrays.
+    names = registry.names
+    primary_signal_ids = registry.primary_signal_ids
+    cycle_second_ids = registry.cycle_second_ids
+    signal_program_ids = registry.signal_program_ids
+    last_primary_signal = registry.last_primary_signal # The last state of the primary signal for each thing
+    last_program = registry.last_program # The last program for each thing
 
     start = 0 # Used as a reference point (unix time 0)
-    last_primary_signal = {} # The last state of the primary signal for each thing
-    last_program = {} # The last program for each thing
     sent_messages = 0 # Counter for the number of messages sent
 
     # Every second, look at the current time and publish the current state
     log('Starting message generator')
     while True:
-        for thing_name, (cycles_by_hour, program_ids_by_hour) in cycles_by_thing_and_hour.items():
+        for idx, (cycles_by_hour, program_ids_by_hour) in enumerate(cycles_by_thing_and_hour):
             # Get the needed datastreams
-            ds_primary_signal = primary_signal_ids_by_thing.get(thing_name)
-            ds_cycle_second = cycle_second_ids_by_thing.get(thing_name)
-            ds_signal_program = signal_program_ids_by_thing.get(thing_name)
+            ds_primary_signal = primary_signal_ids[idx]
+            ds_cycle_second = cycle_second_ids[idx]
+            ds_signal_program = signal_program_ids[idx]
             if ds_primary_signal is None or ds_cycle_second is None or ds_signal_program is None:
-                log(f'No datastream for thing {thing_name}')
+                log(f'No datastream for thing {names[idx]}')
                 continue
 
             hour = datetime.now().hour
@@ -175,15 +91,15 @@ def run_message_generator(things):
 
             # Only publish the primary signal if it has changed.
             should_publish_primary_signal = False
-            if thing_name not in last_primary_signal or last_primary_signal[thing_name] != current_state:
-                last_primary_signal[thing_name] = current_state
+            if last_primary_signal[idx] != current_state:
+                last_primary_signal[idx] = current_state
                 should_publish_primary_signal = True
             # Only publish the cycle second if it has changed.
             should_publish_cycle_second = current_time_in_cycle == 0
             # Only publish the signal program if it has changed.
             should_publish_signal_program = False
-            if thing_name not in last_program or last_program[thing_name] != current_program:
-                last_program[thing_name] = current_program
+            if last_program[idx] != current_program:
+                last_program[idx] = current_program
                 should_publish_signal_program = True
 
             # Prepare the Observation payload.
@@ -233,18 +149,17 @@ def run_message_generator(things):
 
 # Run the message generator if this script is called directly.
 if __name__ == '__main__':
-    from syncer import get_all_things
+    from syncer import iter_things
 
     log('Fetching things to process...')
-    things = get_all_things()
-    things_for_message_generator = [
-        t for t in things 
-        if t['name'] != 'SG1' and t['name'] != 'SG2'
-    ]
+    registry = ThingRegistry.from_things(
+        iter_things(REGISTRY_QUERY),
+        include=lambda name: name != 'SG1' and name != 'SG2',
+    )
 
-    if len(things_for_message_generator) == 0:
+    if len(registry) == 0:
         log('No things found')
         exit(1)
 
-    log(f'Found {len(things_for_message_generator)} things')
-    run_message_generator(things_for_message_generator)
\ No newline at end of file
+    log(f'Found {len(registry)} things')
+    run_message_generator(registry)
\ No newline at end of file
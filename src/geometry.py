@@ -0,0 +1,92 @@
+import json
+import math
+
+import shapely
+
+# Approximate length of one degree of latitude in meters.
+METERS_PER_DEGREE = 111_320
+
+# Decimals kept for coordinates in the compact encoding (~1 cm at Dresden's latitude).
+COMPACT_COORDINATE_DECIMALS = 7
+
+def _meters_per_degree(coords):
+    """
+    Return the local (x, y) scale in meters per degree for the given lon/lat coordinates.
+    """
+    lat = sum(c[1] for c in coords) / len(coords)
+    return METERS_PER_DEGREE * math.cos(math.radians(lat)), METERS_PER_DEGREE
+
+def clip_line(coords, max_length):
+    """
+    Clip a lon/lat line to at most `max_length` meters, measured from its first point.
+    """
+    if max_length <= 0:
+        raise ValueError(f'max_length must be positive, got {max_length}')
+    kx, ky = _meters_per_degree(coords)
+    clipped = [coords[0]]
+    remaining = max_length
+    for (x1, y1), (x2, y2) in zip(coords[:-1], coords[1:]):
+        length = math.hypot((x2 - x1) * kx, (y2 - y1) * ky)
+        if length >= remaining:
+            # Interpolate the end point on this segment and stop.
+            if length > 0:
+                f = remaining / length
+                clipped.append((x1 + (x2 - x1) * f, y1 + (y2 - y1) * f))
+            break
+        clipped.append((x2, y2))
+        remaining -= length
+    return clipped
+
+def simplify_line(coords, tolerance):
+    """
+    Simplify a lon/lat line with the Douglas-Peucker algorithm and a tolerance in meters.
+    """
+    kx, ky = _meters_per_degree(coords)
+    line = shapely.geometry.LineString([(x * kx, y * ky) for x, y in coords])
+    simplified = line.simplify(tolerance, preserve_topology=False)
+    return [(x / kx, y / ky) for x, y in simplified.coords]
+
+def _without_repeated_points(coords):
+    """
+    Remove consecutive duplicate vertices from a line.
+    """
+    return [c for i, c in enumerate(coords) if i == 0 or c != coords[i - 1]]
+
+def make_location_geometry(connection, compact=False, max_length=None, simplify_tolerance=None):
+    """
+    Make the MultiLineString coordinates (ingress, connection, egress) for a lane connection.
+
+    By default, the connection is used as ingress, connection and egress.
+    With `compact`, the ingress and egress are minimal stubs (the first and the last
+    segment of the connection) and the coordinates are rounded. Every line keeps at least two positions. The connection can
+    further be clipped to `max_length` meters and simplified with `simplify_tolerance` meters.
+    """
+    connection = [tuple(c) for c in connection]
+    if max_length is not None:
+        connection = clip_line(connection, max_length)
+    if simplify_tolerance is not None:
+        connection = simplify_line(connection, simplify_tolerance)
+    if not compact:
+        return [connection, connection, connection]
+
+    distinct = _without_repeated_points(connection)
+    rounded = _without_repeated_points([
+        (round(x, COMPACT_COORDINATE_DECIMALS), round(y, COMPACT_COORDINATE_DECIMALS))
+        for x, y in distinct
+    ])
+    # A LineString needs two positions. Keep the unrounded vertices if rounding would collapse
+    # the connection to a single point, and the connection as is if it only has one distinct
+    # point (e.g. when the traffic light is on the last vertex of its way).
+    if len(rounded) >= 2:
+        connection = rounded
+    elif len(distinct) >= 2:
+        connection = distinct
+    ingress = connection[:2]
+    egress = connection[-2:]
+    return [ingress, connection, egress]
+
+def encoded_size(coordinates):
+    """
+    Return the size in bytes of the JSON encoded coordinates, as they are sent to the FROST server.
+    """
+    return len(json.dumps(coordinates).encode('utf-8'))
@@ -0,0 +1,92 @@
+from array import array
+
+# Sentinel for "no state published yet" in the compact state arrays.
+UNKNOWN = -1
+
+# Query for `syncer.iter_things()` that only fetches the fields needed by the registry.
+REGISTRY_QUERY = '$select=name&$expand=Datastreams($select=id,properties)'
+
+class ThingRegistry:
+    """
+    Compact in-memory registry of the things used by the long-running services.
+
+    The FROST server returns each Thing with its expanded Locations and Datastreams.
+    The generator and the converter only need the name of a thing and the IDs of
+    three of its Datastreams, so this registry keeps only those in parallel arrays
+    indexed by an integer thing index. The raw JSON is not referenced after loading.
+    """
+    __slots__ = (
+        'names',
+        'index_by_name',
+        'primary_signal_ids',
+        'cycle_second_ids',
+        'signal_program_ids',
+        'last_primary_signal',
+        'last_program',
+    )
+
+    def __init__(self):
+        self.names = [] # Thing name by thing index
+        self.index_by_name = {} # Thing index by thing name
+        # Datastream IDs by thing index (None if the thing has no such datastream)
+        self.primary_signal_ids = []
+        self.cycle_second_ids = []
+        self.signal_program_ids = []
+        # The last published states by thing index (UNKNOWN if nothing was published yet)
+        self.last_primary_signal = array('b')
+        self.last_program = array('h')
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, thing):
+        """
+        Add a thing (as returned by the FROST server) and return its index.
+
+        Only the name and the relevant Datastream IDs are copied from the thing.
+        """
+        primary_signal_id = None
+        cycle_second_id = None
+        signal_program_id = None
+        for datastream in thing['Datastreams']:
+            # properties -> layerName
+            layer_name = datastream['properties']['layerName']
+            if layer_name == 'primary_signal':
+                primary_signal_id = datastream['@iot.id']
+            elif layer_name == 'cycle_second':
+                cycle_second_id = datastream['@iot.id']
+            elif layer_name == 'signal_program':
+                signal_program_id = datastream['@iot.id']
+
+        name = thing['name']
+        idx = self.index_by_name.get(name)
+        if idx is None:
+            idx = len(self.names)
+            self.names.append(name)
+            self.index_by_name[name] = idx
+            self.primary_signal_ids.append(primary_signal_id)
+            self.cycle_second_ids.append(cycle_second_id)
+            self.signal_program_ids.append(signal_program_id)
+            self.last_primary_signal.append(UNKNOWN)
+            self.last_program.append(UNKNOWN)
+        else:
+            # Duplicate name: the last occurrence wins, as with the previous dicts.
+            self.primary_signal_ids[idx] = primary_signal_id
+            self.cycle_second_ids[idx] = cycle_second_id
+            self.signal_program_ids[idx] = signal_program_id
+        return idx
+
+    @classmethod
+    def from_things(cls, things, include=None):
+        """
+        Build a registry from an iterable of things.
+
+        `include` is an optional predicate on the thing name. Pass a generator
+        (e.g. `syncer.iter_things(REGISTRY_QUERY)`) to avoid holding the full fleet in memory.
+        """
+        registry = cls()
+        for thing in things:
+            if include is not None and not include(thing['name']):
+                continue
+            registry.add(thing)
+        return registry
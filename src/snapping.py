@@ -0,0 +1,296 @@
+import json
+import multiprocessing
+import os
+import re
+import sys
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import shapely
+
+from log import log
+
+# Number of characters read from a GeoJSON file at once.
+READ_CHUNK_SIZE = 1 << 16
+
+# Characters that matter to find the end of a JSON object or array (outside and inside of strings).
+STRUCTURE_CHARS = re.compile(r'["\[\]{}]')
+STRING_CHARS = re.compile(r'["\\]')
+
+# Segments with one of these tags are not roads (unless they also have a road tag).
+IRRELEVANT_SEGMENT_TAGS = (
+    'landuse',
+    'building',
+    'railway',
+    'barrier',
+    'amenity',
+    'natural',
+    'leisure',
+    'waterway',
+    'power',
+    'man_made',
+)
+# Road tags, including road surface areas (e.g. the road area of a junction).
+ROAD_SEGMENT_TAGS = ('highway', 'area:highway')
+
+def is_relevant_segment(properties):
+    """
+    Check whether a segment (by its OSM tags) should be used to snap traffic lights to.
+    """
+    if any(tag in properties for tag in ROAD_SEGMENT_TAGS):
+        return True
+    return not any(tag in properties for tag in IRRELEVANT_SEGMENT_TAGS)
+
+def iter_features(path, read_chunk_size=READ_CHUNK_SIZE):
+    """
+    Iterate over the features of a GeoJSON FeatureCollection file without loading it completely.
+
+    Only the current feature (and a small read buffer) is kept in memory.
+    Other top-level members (e.g. "generator" or "copyright" of Overpass exports) are skipped.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, encoding='utf-8') as f:
+        buffer = ''
+        pos = 0
+
+        def read_more():
+            """
+            Append the next chunk of the file to the buffer. Return False at the end of the file.
+            """
+            nonlocal buffer, pos
+            chunk = f.read(read_chunk_size)
+            if not chunk:
+                return False
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            return True
+
+        def peek():
+            """
+            Skip whitespace and return the next character ('' at the end of the file).
+            """
+            nonlocal pos
+            while True:
+                while pos < len(buffer) and buffer[pos] in ' \t\r\n':
+                    pos += 1
+                if pos < len(buffer):
+                    return buffer[pos]
+                if not read_more():
+                    return ''
+
+        def expect(chars):
+            """
+            Consume the next character, which must be one of `chars`.
+            """
+            nonlocal pos
+            char = peek()
+            if char == '' or char not in chars:
+                raise ValueError(f'Invalid GeoJSON in {path}: expected one of {chars!r}, got {char!r}')
+            pos += 1
+            return char
+
+        # State of `scan_container()` between chunks.
+        depth = 0
+        in_string = False
+        escape = False
+
+        def scan_container(text, i):
+            """
+            Scan `text` from `i` for the end of the current object or array.
+
+            Returns the index after its closing bracket, or None if it does not end in `text`.
+            """
+            nonlocal depth, in_string, escape
+            while i < len(text):
+                if escape:
+                    escape = False
+                    i += 1
+                elif in_string:
+                    match = STRING_CHARS.search(text, i)
+                    if match is None:
+                        return None
+                    i = match.end()
+                    if match.group() == '\\':
+                        escape = True
+                    else:
+                        in_string = False
+                else:
+                    match = STRUCTURE_CHARS.search(text, i)
+                    if match is None:
+                        return None
+                    i = match.end()
+                    char = match.group()
+                    if char == '"':
+                        in_string = True
+                    elif char == '[' or char == '{':
+                        depth += 1
+                    else:
+                        depth -= 1
+                        if depth == 0:
+                            return i
+            return None
+
+        def decode_value():
+            """
+            Decode the next JSON value, reading more of the file until it is complete.
+
+            Objects and arrays are read until their end was found and then decoded once,
+            so large features (e.g. landuse multipolygons) take linear time.
+            """
+            nonlocal buffer, pos, depth, in_string, escape
+            if peek() in ('{', '['):
+                depth, in_string, escape = 0, False, False
+                end = scan_container(buffer, pos)
+                if end is None:
+                    chunks = [buffer[pos:]]
+                    while end is None:
+                        chunk = f.read(read_chunk_size)
+                        if not chunk:
+                            raise ValueError(f'Invalid GeoJSON in {path}: unexpected end of file')
+                        chunks.append(chunk)
+                        end = scan_container(chunk, 0)
+                    buffer = ''.join(chunks)
+                    pos = 0
+                value, pos = decoder.raw_decode(buffer, pos)
+                if pos > read_chunk_size:
+                    # Release the text of a large value.
+                    buffer = buffer[pos:]
+                    pos = 0
+                return value
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if read_more():
+                        continue
+                    raise
+                # A value ending at the end of the buffer (e.g. a number) may be truncated.
+                if end == len(buffer) and read_more():
+                    continue
+                pos = end
+                return value
+
+        expect('{')
+        if peek() == '}':
+            return
+        while True:
+            key = decode_value()
+            expect(':')
+            if key == 'features':
+                expect('[')
+                if peek() == ']':
+                    pos += 1
+                else:
+                    while True:
+                        yield decode_value()
+                        if expect(',]') == ']':
+                            break
+            else:
+                decode_value()
+            if expect(',}') == '}':
+                break
+
+def load_segment_lines(path):
+    """
+    Load the lines of all road segments from a GeoJSON file.
+
+    Irrelevant features (e.g. landuse polygons or railways, see `is_relevant_segment()`)
+    are filtered out while streaming, and only the geometries are kept.
+    """
+    lines = []
+    for feature in iter_features(path):
+        if not is_relevant_segment(feature.get('properties') or {}):
+            continue
+        geometry = feature['geometry']
+        if geometry['type'] == 'MultiLineString' or geometry['type'] == 'Polygon':
+            for line in geometry['coordinates']:
+                lines.append(shapely.geometry.LineString(line))
+        elif geometry['type'] == 'LineString':
+            lines.append(shapely.geometry.LineString(geometry['coordinates']))
+        else:
+            log(f'WARN Unknown geometry type: {geometry["type"]}')
+    return lines
+
+# The segment lines and their spatial index in the current process.
+_lines = None
+_tree = None
+
+def _init_segments(lines):
+    """
+    Build the spatial index of the segment lines in the current process.
+    """
+    global _lines, _tree
+    _lines = lines
+    _tree = shapely.STRtree(lines)
+
+def _snap_chunk(points):
+    """
+    Snap a chunk of (lon, lat) points to their nearest segment line.
+
+    Returns the connection geometry for each point: from the point to the end of the segment.
+    """
+    connections = []
+    for coords in points:
+        point = shapely.geometry.Point(coords)
+        # Of several equally near lines, take the first one in file order to stay deterministic.
+        nearest_line = _lines[min(_tree.query_nearest(point, all_matches=True))]
+
+        nearest_point_idx = None
+        nearest_point_distance = float('inf')
+        for i, (segment_point_1, segment_point_2) in enumerate(zip(nearest_line.coords[:-1], nearest_line.coords[1:])):
+            distance = shapely.geometry.LineString([segment_point_1, segment_point_2]).distance(point)
+            if distance < nearest_point_distance:
+                nearest_point_distance = distance
+                nearest_point_idx = i
+
+        # Connection geometry: from the traffic light to the end of the segment
+        connection = [
+            point.coords[0],
+        ] + nearest_line.coords[nearest_point_idx + 1:]
+        connections.append(connection)
+    return connections
+
+def _chunked(iterable, chunk_size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def snap_points(points, lines, workers=None, chunk_size=256):
+    """
+    Snap (lon, lat) points to their nearest line and yield the connection geometries in input order.
+
+    The points are consumed lazily and snapped in chunks across `workers` processes
+    (default: all cores). At most two chunks per worker are in flight at any time.
+    The spatial index is built once in this process. On Linux, the workers are forked (if this
+    process is single-threaded) and share it (copy-on-write) instead of each receiving a copy of the lines.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 0 or chunk_size <= 0:
+        raise ValueError(f'workers and chunk_size must be positive, got {workers} and {chunk_size}')
+    chunks = _chunked(points, chunk_size)
+    _init_segments(lines)
+    if workers == 1:
+        for chunk in chunks:
+            yield from _snap_chunk(chunk)
+        return
+
+    # Forking is unsafe on macOS (even though it is available there) and in multi-threaded processes.
+    if sys.platform == 'linux' and threading.active_count() == 1:
+        executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork'))
+    else:
+        executor = ProcessPoolExecutor(workers, initializer=_init_segments, initargs=(lines,))
+    with executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(_snap_chunk, chunk))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
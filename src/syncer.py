@@ -1,31 +1,74 @@
-import json
+import contextlib
+import csv
+import itertools
 import os
 
 import requests
-import shapely
 from tqdm import tqdm
 
+from geometry import encoded_size, make_location_geometry
 from log import log
+from snapping import iter_features, load_segment_lines, snap_points
 
 FROST_BASE_URL = os.environ.get('FROST_BASE_URL')
 if FROST_BASE_URL is None:
     raise ValueError('FROST_BASE_URL environment variable is not set.')
 
-def get_all_things():
+# OSM input files, see the README on how to get them.
+LOCATIONS_PATH = os.environ.get('LOCATIONS_PATH', 'locations.geojson')
+SEGMENTS_PATH = os.environ.get('SEGMENTS_PATH', 'segments.geojson')
+# Number of processes to snap the traffic lights with (default: all cores) and traffic lights per task.
+SNAPPING_WORKERS = os.environ.get('SNAPPING_WORKERS')
+SNAPPING_WORKERS = int(SNAPPING_WORKERS) if SNAPPING_WORKERS else None
+if SNAPPING_WORKERS is not None and SNAPPING_WORKERS <= 0:
+    raise ValueError(f'SNAPPING_WORKERS must be positive, got {SNAPPING_WORKERS}')
+SNAPPING_CHUNK_SIZE = int(os.environ.get('SNAPPING_CHUNK_SIZE') or 256)
+if SNAPPING_CHUNK_SIZE <= 0:
+    raise ValueError(f'SNAPPING_CHUNK_SIZE must be positive, got {SNAPPING_CHUNK_SIZE}')
+
+# Don't start tqdm's monitor thread, so that the snapping workers are forked from a single-threaded process.
+tqdm.monitor_interval = 0
+
+# Optional settings for the Location geometries of the inserted things.
+# "full" (default) repeats the connection as ingress and egress, "compact" uses minimal stubs.
+LOCATION_ENCODING = os.environ.get('LOCATION_ENCODING', 'full')
+if LOCATION_ENCODING not in ('full', 'compact'):
+    raise ValueError(f'Unknown LOCATION_ENCODING: {LOCATION_ENCODING}')
+# Maximum length of the connection in meters.
+LOCATION_MAX_LENGTH = os.environ.get('LOCATION_MAX_LENGTH')
+LOCATION_MAX_LENGTH = float(LOCATION_MAX_LENGTH) if LOCATION_MAX_LENGTH else None
+if LOCATION_MAX_LENGTH is not None and LOCATION_MAX_LENGTH <= 0:
+    raise ValueError(f'LOCATION_MAX_LENGTH must be positive, got {LOCATION_MAX_LENGTH}')
+# Tolerance in meters to simplify the connection.
+LOCATION_SIMPLIFY_TOLERANCE = os.environ.get('LOCATION_SIMPLIFY_TOLERANCE')
+LOCATION_SIMPLIFY_TOLERANCE = float(LOCATION_SIMPLIFY_TOLERANCE) if LOCATION_SIMPLIFY_TOLERANCE else None
+if LOCATION_SIMPLIFY_TOLERANCE is not None and LOCATION_SIMPLIFY_TOLERANCE < 0:
+    raise ValueError(f'LOCATION_SIMPLIFY_TOLERANCE must not be negative, got {LOCATION_SIMPLIFY_TOLERANCE}')
+# Optional CSV file to write the bytes saved per thing to.
+LOCATION_REPORT_PATH = os.environ.get('LOCATION_REPORT_PATH')
+
+def iter_things(query='$expand=Locations,Datastreams'):
     """
-    Get all things from the FROST server.
+    Iterate over all things from the FROST server, one page at a time.
+
+    Only the current page is kept in memory, so callers that condense
+    the things (e.g. into a `ThingRegistry`) never hold the full fleet.
+    The query can be used to fetch only the needed fields.
     """
-    things = []
-    link = f'{FROST_BASE_URL}Things?$expand=Locations,Datastreams'
+    link = f'{FROST_BASE_URL}Things?{query}'
     while True:
-        response = requests.get(link)
-        things.extend(response.json()['value'])
+        page = requests.get(link).json()
+        yield from page['value']
         # Check if we have a next page to fetch
-        if '@iot.nextLink' in response.json():
-            link = response.json()['@iot.nextLink']
-            continue
-        break
-    return things
+        link = page.get('@iot.nextLink')
+        if link is None:
+            break
+
+def get_all_things():
+    """
+    Get all things from the FROST server.
+    """
+    return list(iter_things())
 
 def sync_things():
     """
@@ -35,6 +78,7 @@ def sync_things():
     1. Delete all existing things from the FROST server.
     2. Insert the generated traffic lights into the FROST server.
     Step 2 includes 2 TLS traffic lights that will get the names SG1 and SG2.
+    Returns the number of inserted things.
     """
     # Fetch all things from FROST server and delete them
     log("Deleting all things from the FROST server.")
@@ -47,13 +91,7 @@ def sync_things():
             requests.delete(f'{FROST_BASE_URL}Things({thing["@iot.id"]})')
         assert response.status_code == 201 or response.status_code == 200
 
-    with open('locations.geojson') as f:
-        traffic_lights_locations = json.load(f)
-
-    with open('segments.geojson') as f:
-        traffic_light_segments = json.load(f)
-
-    traffic_light_geometries = [
+    tls_traffic_light_geometries = [
         # SG1
         [
             [
@@ -83,48 +121,22 @@ def sync_things():
     ]
 
     # Snap each traffic light to the nearest segment
-    log("OSM Preprocessing: snapping traffic lights to the nearest segment.")
-    for feature in tqdm(traffic_lights_locations['features']):
-        osm_id = feature['properties']['@id']
+    log(f"OSM Preprocessing: loading segments from {SEGMENTS_PATH}.")
+    segment_lines = load_segment_lines(SEGMENTS_PATH)
+    log(f"OSM Preprocessing: snapping traffic lights from {LOCATIONS_PATH} to the nearest of {len(segment_lines)} segments.")
+    points = (
+        feature['geometry']['coordinates']
+        for feature in iter_features(LOCATIONS_PATH)
+        if feature['geometry']['type'] == 'Point'
         # Exclude traffic lights at POT building to not interfere with our real traffic lights there.
-        if osm_id == "node/2671296691" or osm_id == "node/2553635365":
-            continue
-        point = shapely.geometry.shape(feature['geometry'])
-        nearest_line = None
-        nearest_distance = float('inf')
-        for segment in traffic_light_segments['features']:
-            if segment['geometry']['type'] == 'MultiLineString' or segment['geometry']['type'] == 'Polygon':
-                for line in segment['geometry']['coordinates']:
-                    line = shapely.geometry.LineString(line)
-                    distance = point.distance(line)
-                    if distance < nearest_distance:
-                        nearest_distance = distance
-                        nearest_line = line
-            elif segment['geometry']['type'] == 'LineString':
-                line = shapely.geometry.LineString(segment['geometry']['coordinates'])
-                distance = point.distance(line)
-                if distance < nearest_distance:
-                    nearest_distance = distance
-                    nearest_line = line
-            else:
-                log(f'WARN Unknown geometry type: {segment["geometry"]["type"]}')
-
-        nearest_point_idx = None
-        nearest_point_distance = float('inf')
-        for i, (segment_point_1, segment_point_2) in enumerate(zip(nearest_line.coords[:-1], nearest_line.coords[1:])):
-            segment_point_1 = shapely.geometry.Point(segment_point_1)
-            segment_point_2 = shapely.geometry.Point(segment_point_2)
-            distance = shapely.geometry.LineString([segment_point_1, segment_point_2]).distance(point)
-            if distance < nearest_point_distance:
-                nearest_point_distance = distance
-                nearest_point_idx = i
-
-        # Connection geometry: from the traffic light to the end of the segment
-        connection = [
-            point.coords[0],
-        ] + nearest_line.coords[nearest_point_idx + 1:]
-
-        traffic_light_geometries.append(connection)
+        and feature['properties']['@id'] != "node/2671296691"
+        and feature['properties']['@id'] != "node/2553635365"
+    )
+    # The snapped connections are inserted as they arrive, without collecting them first.
+    traffic_light_geometries = itertools.chain(
+        tls_traffic_light_geometries,
+        snap_points(points, segment_lines, workers=SNAPPING_WORKERS, chunk_size=SNAPPING_CHUNK_SIZE),
+    )
 
     base_idx = 1 # Offset for the lane IDs
     def get_idx():
@@ -133,154 +145,179 @@ def sync_things():
         return base_idx
 
     log("Inserting the generated traffic lights into the FROST server.")
-    for i, geometry in tqdm(enumerate(traffic_light_geometries)):
-        thing_name = f"SG{i+1}"
+    # Count the bytes saved by the Location encoding, and optionally report them per thing.
+    things_total = 0
+    bytes_full_total = 0
+    bytes_saved_total = 0
+    report = None
+    with contextlib.ExitStack() as stack:
+        if LOCATION_REPORT_PATH:
+            report = csv.writer(stack.enter_context(open(LOCATION_REPORT_PATH, 'w', newline='')))
+            report.writerow(['thing', 'bytes_full', 'bytes_saved'])
+        for i, geometry in tqdm(enumerate(traffic_light_geometries)):
+            thing_name = f"SG{i+1}"
 
-        location = {
-            "description": "The given geometry composed out of ingress lane, egress lane and the real route represents the location of the lane connection.",
-            "encodingType": "application/vnd.geo+json",
-            "location": {
-                "type": "Feature",
-                "geometry": {
-                    "type": "MultiLineString",
-                    "coordinates": [
-                        geometry, # Completely irrelevant, just use the same geometry for the ingress
-                        geometry,
-                        geometry, # Completely irrelevant, just use the same geometry for the egress
-                    ]
-                }
-            },
-            "name": thing_name,
-        }
+            coordinates = make_location_geometry(
+                geometry,
+                compact=LOCATION_ENCODING == 'compact',
+                max_length=LOCATION_MAX_LENGTH,
+                simplify_tolerance=LOCATION_SIMPLIFY_TOLERANCE,
+            )
+            # Compare with the full encoding of the unmodified connection.
+            bytes_full = encoded_size(make_location_geometry(geometry))
+            bytes_saved = bytes_full - encoded_size(coordinates)
+            things_total += 1
+            bytes_full_total += bytes_full
+            bytes_saved_total += bytes_saved
+            if report is not None:
+                report.writerow([thing_name, bytes_full, bytes_saved])
 
-        dstr_program = {
-            "description": "A unique ID (name) of the current signal program of the traffic light. It is not the control program",
-            "name": f"Signal program ID at {thing_name}",
-            "observationType": "http://defs.opengis.net/elda-common/ogc-def/resource?uri=http://www.opengis.net/def/property/OGC/0/SensorStatus",
-            "properties": {
-                "layerName": "signal_program",
-                "namespace": "Not yet available",
-                "ownerData": "Free and Hanseatic City of Hamburg",
-                "serviceName": "HH_STA_traffic_lights",
-                "resultsNature": "Primary",
-                "signalGroupID": "K2",
-                "mediaMonitored": "Transport",
-                "lastUpdateSignalProgram": "2021-10-22T07:40:30.138+00:00" # Completely irrelevant
-            },
-            "unitOfMeasurement": {
-                "name": "Status",
-                "symbol": "-",
-                "definition": "morgen, mittag, ..."
-            },
-            "Sensor": {
-                "description": "Not available",
-                "encodingType": "Not available",
-                "metadata": "Not available",
-                "name": "Signal program indicator",
-            },
-            "ObservedProperty": {
-                "description": "A signal is information broadcasted e.g. visually or acoustically. The possible transmitted information is reported in the API entity 'datastream' using the 'unitOfMeasurment'-field",
-                "definition": "Not available",
-                "name": "Signal",
+            location = {
+                "description": "The given geometry composed out of ingress lane, egress lane and the real route represents the location of the lane connection.",
+                "encodingType": "application/vnd.geo+json",
+                "location": {
+                    "type": "Feature",
+                    "geometry": {
+                        "type": "MultiLineString",
+                        "coordinates": coordinates, # Ingress, connection, egress
+                    }
+                },
+                "name": thing_name,
             }
-        }
 
-        dstr_cycle = {
-            "description": "Current second in the traffic signal cycle",
-            "name": f"Cycle second at {thing_name}",
-            "observationType": "Primary",
-            "properties": {
-                "layerName": "cycle_second",
-                "namespace": "Not yet available",
-                "ownerData": "Free and Hanseatic City of Hamburg",
-                "serviceName": "HH_STA_traffic_lights",
-                "resultsNature": "Primary",
-                "signalGroupID": "K2",
-                "mediaMonitored": "Transport",
-                "lastUpdateCycleSecond": "2021-10-22T07:40:30.140+00:00" # Completely irrelevant
-            },
-            "unitOfMeasurement": {
-                "name": "Second",
-                "symbol": "s",
-                "definition": ""
-            },
-            "Sensor": {
-                "description": "Not available",
-                "encodingType": "Not available",
-                "metadata": "Not available",
-                "name": "Cycle second indicator",
-            },
-            "ObservedProperty": {
-                "description": "A signal is information broadcasted e.g. visually or acoustically. The possible transmitted information is reported in the API entity 'datastream' using the 'unitOfMeasurment'-field",
-                "definition": "Not available",
-                "name": "Signal",
+            dstr_program = {
+                "description": "A unique ID (name) of the current signal program of the traffic light. It is not the control program",
+                "name": f"Signal program ID at {thing_name}",
+                "observationType": "http://defs.opengis.net/elda-common/ogc-def/resource?uri=http://www.opengis.net/def/property/OGC/0/SensorStatus",
+                "properties": {
+                    "layerName": "signal_program",
+                    "namespace": "Not yet available",
+                    "ownerData": "Free and Hanseatic City of Hamburg",
+                    "serviceName": "HH_STA_traffic_lights",
+                    "resultsNature": "Primary",
+                    "signalGroupID": "K2",
+                    "mediaMonitored": "Transport",
+                    "lastUpdateSignalProgram": "2021-10-22T07:40:30.138+00:00" # Completely irrelevant
+                },
+                "unitOfMeasurement": {
+                    "name": "Status",
+                    "symbol": "-",
+                    "definition": "morgen, mittag, ..."
+                },
+                "Sensor": {
+                    "description": "Not available",
+                    "encodingType": "Not available",
+                    "metadata": "Not available",
+                    "name": "Signal program indicator",
+                },
+                "ObservedProperty": {
+                    "description": "A signal is information broadcasted e.g. visually or acoustically. The possible transmitted information is reported in the API entity 'datastream' using the 'unitOfMeasurment'-field",
+                    "definition": "Not available",
+                    "name": "Signal",
+                }
             }
-        }
 
-        dstr_primary = {
-            "description": "Datastream to broadcast the lane connection's signal value of a signal group",
-            "name": f"Primary signal heads at {thing_name}",
-            "observationType": "http://defs.opengis.net/elda-common/ogc-def/resource?uri=http://www.opengis.net/def/property/OGC/0/SensorStatus",
-            "properties": {
-                "layerName": "primary_signal",
-                "namespace": "Not yet available",
-                "ownerData": "Free and Hanseatic City of Hamburg",
-                "serviceName": "HH_STA_traffic_lights",
-                "resultsNature": "Primary",
-                "signalGroupID": "K2",
-                "mediaMonitored": "Transport"
-            },
-            "unitOfMeasurement": {
-                "name": "Status",
-                "symbol": "Integer dimensionless",
-                "definition": "0=dark,1=red,2=amber,3=green,4=red-amber,5=amber-flashing,6=green-flashing,9=unknown"
-            },
-            "Sensor": {
-                "description": "A signal head emits information. The data specific implementation/type of signal heads is described in the 'datastream'",
-                "encodingType": "Not available",
-                "metadata": "Signal heads belong to the basic components of a traffic signal system. Depending on the road users and the applications to which the signals are assigned different signal heads exist. Optical signal heads generally apply to motor vehicle signals, pedestrian signals, cycle signals, tram and bus signals, auxiliary signals (amber flashing light), speed signals",
-                "name": "Signal heads of traffic lights",
-            },
-            "ObservedProperty": {
-                "description": "A signal is information broadcasted e.g. visually or acoustically. The possible transmitted information is reported in the API entity 'datastream' using the 'unitOfMeasurment'-field",
-                "definition": "Not available",
-                "name": "Signal",
+            dstr_cycle = {
+                "description": "Current second in the traffic signal cycle",
+                "name": f"Cycle second at {thing_name}",
+                "observationType": "Primary",
+                "properties": {
+                    "layerName": "cycle_second",
+                    "namespace": "Not yet available",
+                    "ownerData": "Free and Hanseatic City of Hamburg",
+                    "serviceName": "HH_STA_traffic_lights",
+                    "resultsNature": "Primary",
+                    "signalGroupID": "K2",
+                    "mediaMonitored": "Transport",
+                    "lastUpdateCycleSecond": "2021-10-22T07:40:30.140+00:00" # Completely irrelevant
+                },
+                "unitOfMeasurement": {
+                    "name": "Second",
+                    "symbol": "s",
+                    "definition": ""
+                },
+                "Sensor": {
+                    "description": "Not available",
+                    "encodingType": "Not available",
+                    "metadata": "Not available",
+                    "name": "Cycle second indicator",
+                },
+                "ObservedProperty": {
+                    "description": "A signal is information broadcasted e.g. visually or acoustically. The possible transmitted information is reported in the API entity 'datastream' using the 'unitOfMeasurment'-field",
+                    "definition": "Not available",
+                    "name": "Signal",
+                }
             }
-        }
 
-        sg_json = {
-            "description": "Connection of lanes subject to a specific signal head",
-            "name": thing_name,
-            "properties": {
-                "topic": "Transportation and traffic",
-                "assetID": "Not available",
-                "keywords": [
-                    "TLF",
-                    "LSA",
-                    "Dresden"
-                ],
-                "laneType": "Radfahrer",
-                "language": "EN",
-                "ownerThing": "TU Dresden",
-                "connectionID": f"{get_idx()}", # Completely irrelevant
-                "egressLaneID": f"{get_idx()}", # Completely irrelevant
-                "ingressLaneID": f"{get_idx()}", # Completely irrelevant
-                "infoLastUpdate": "2021-10-22T07:40:29.229+00:00", # Completely irrelevant
-                "trafficLightsID": f"{get_idx()}" # Completely irrelevant
-            },
-            "Locations": [ location ],
-            "Datastreams": [
-                dstr_program,
-                dstr_cycle,
-                dstr_primary,
-            ]
-        }
+            dstr_primary = {
+                "description": "Datastream to broadcast the lane connection's signal value of a signal group",
+                "name": f"Primary signal heads at {thing_name}",
+                "observationType": "http://defs.opengis.net/elda-common/ogc-def/resource?uri=http://www.opengis.net/def/property/OGC/0/SensorStatus",
+                "properties": {
+                    "layerName": "primary_signal",
+                    "namespace": "Not yet available",
+                    "ownerData": "Free and Hanseatic City of Hamburg",
+                    "serviceName": "HH_STA_traffic_lights",
+                    "resultsNature": "Primary",
+                    "signalGroupID": "K2",
+                    "mediaMonitored": "Transport"
+                },
+                "unitOfMeasurement": {
+                    "name": "Status",
+                    "symbol": "Integer dimensionless",
+                    "definition": "0=dark,1=red,2=amber,3=green,4=red-amber,5=amber-flashing,6=green-flashing,9=unknown"
+                },
+                "Sensor": {
+                    "description": "A signal head emits information. The data specific implementation/type of signal heads is described in the 'datastream'",
+                    "encodingType": "Not available",
+                    "metadata": "Signal heads belong to the basic components of a traffic signal system. Depending on the road users and the applications to which the signals are assigned different signal heads exist. Optical signal heads generally apply to motor vehicle signals, pedestrian signals, cycle signals, tram and bus signals, auxiliary signals (amber flashing light), speed signals",
+                    "name": "Signal heads of traffic lights",
+                },
+                "ObservedProperty": {
+                    "description": "A signal is information broadcasted e.g. visually or acoustically. The possible transmitted information is reported in the API entity 'datastream' using the 'unitOfMeasurment'-field",
+                    "definition": "Not available",
+                    "name": "Signal",
+                }
+            }
 
-        response = requests.post(f'{FROST_BASE_URL}Things', json=sg_json)
-        assert response.status_code == 201 or response.status_code == 200
+            sg_json = {
+                "description": "Connection of lanes subject to a specific signal head",
+                "name": thing_name,
+                "properties": {
+                    "topic": "Transportation and traffic",
+                    "assetID": "Not available",
+                    "keywords": [
+                        "TLF",
+                        "LSA",
+                        "Dresden"
+                    ],
+                    "laneType": "Radfahrer",
+                    "language": "EN",
+                    "ownerThing": "TU Dresden",
+                    "connectionID": f"{get_idx()}", # Completely irrelevant
+                    "egressLaneID": f"{get_idx()}", # Completely irrelevant
+                    "ingressLaneID": f"{get_idx()}", # Completely irrelevant
+                    "infoLastUpdate": "2021-10-22T07:40:29.229+00:00", # Completely irrelevant
+                    "trafficLightsID": f"{get_idx()}" # Completely irrelevant
+                },
+                "Locations": [ location ],
+                "Datastreams": [
+                    dstr_program,
+                    dstr_cycle,
+                    dstr_primary,
+                ]
+            }
+
+            response = requests.post(f'{FROST_BASE_URL}Things', json=sg_json)
+            assert response.status_code == 201 or response.status_code == 200
     
     log("Finished inserting things.")
-    return get_all_things()
+
+    log(f"Location geometries: saved {bytes_saved_total} of {bytes_full_total} bytes "
+        f"({bytes_saved_total / max(bytes_full_total, 1) * 100:.1f}%) for {things_total} things.")
+    if report is not None:
+        log(f"Wrote the bytes saved per thing to {LOCATION_REPORT_PATH}.")
+    return things_total
 
 if __name__ == '__main__':
-    log(f'{len(sync_things())} Things in FROST server.')
\ No newline at end of file
+    log(f'{sync_things()} Things inserted into the FROST server.')
\ No newline at end of file